@@ -1,17 +1,36 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import duckdb
+import hashlib
+import os
+import tempfile
+import time
+import pyarrow as pa
 from pathlib import Path
-import streamlit.components.v1 as components
 
-import plotly.express as px
 import plotly.graph_objects as go
+from plotly.colors import sample_colorscale
 from plotly.subplots import make_subplots
 
 # ---------------- App Configuration ----------------
 st.set_page_config(page_title="NYC CitiBike Dashboard", layout="wide")
 
+# Copy-on-Write is always on from pandas 3.0; opt in on older versions so
+# column selections below stay views until written to
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
 DATA_FILE = "citibike_sample_1.parquet"
+# Per-day and per-(day, station) aggregates built from DATA_FILE by prepare_data.py;
+# the pages only ever read these
+DAILY_FILE = "daily.parquet"
+STATION_DAILY_FILE = "station_daily.parquet"
 DEFAULT_MAP_HTML = "top_50_stop_and_end_stations_heat.html"  
+MAP_DIR = Path("static")  # served by Streamlit at app/static/ (see .streamlit/config.toml)
+MAX_POINTS = 500  # per line trace; longer series are reduced with LTTB
+CACHE_DIR = Path(".cache")  # Arrow IPC snapshots of query results, survive restarts
+CACHE_MAX_FILES = 200  # least recently used snapshots beyond this are deleted
 
 BG = "#0E1117"
 GRID = "rgba(255,255,255,0.08)"
@@ -19,14 +38,151 @@ FONT = "rgba(255,255,255,0.92)"
 
 
 # ---------------- Helpers ----------------
+# Shared by every session; a connection is not thread-safe, so callers run
+# their queries on their own .cursor()
+@st.cache_resource(show_spinner=False)
+def get_con() -> duckdb.DuckDBPyConnection:
+    con = duckdb.connect()
+    con.execute(f"CREATE VIEW daily AS SELECT * FROM read_parquet('{DAILY_FILE}')")
+    con.execute(f"CREATE VIEW station_daily AS SELECT * FROM read_parquet('{STATION_DAILY_FILE}')")
+    return con
+
+def evict_cache(version: str):
+    # Drop snapshots from older data versions, then the least recently used beyond the cap
+    snapshots = []
+    for p in CACHE_DIR.glob("*.arrow"):
+        try:
+            if not p.name.startswith(f"{version}-"):
+                p.unlink()
+            else:
+                snapshots.append((p.stat().st_mtime, p))
+        except OSError:
+            pass  # already removed by another session
+    snapshots.sort(reverse=True)
+    for _, p in snapshots[CACHE_MAX_FILES:]:
+        p.unlink(missing_ok=True)
+    # Temp files left behind by a worker killed mid-write
+    for p in CACHE_DIR.glob("*.tmp"):
+        try:
+            if time.time() - p.stat().st_mtime > 3600:
+                p.unlink()
+        except OSError:
+            pass
+
+def data_version() -> tuple:
+    # The aggregate files' mtimes; every cache layer takes this as a key so a
+    # rebuild by prepare_data.py invalidates them all together
+    return tuple((f, Path(f).stat().st_mtime_ns) for f in (DAILY_FILE, STATION_DAILY_FILE))
+
+def query(sql: str, params: list) -> pd.DataFrame:
+    # File names start with a hash of the data version, so a rebuilt parquet
+    # invalidates them and the old generation can be cleared by prefix
+    version = hashlib.sha1(repr(data_version()).encode()).hexdigest()[:12]
+    key = hashlib.sha1(repr((sql, params)).encode()).hexdigest()
+    cache_path = CACHE_DIR / f"{version}-{key}.arrow"
+    table = None
+    if cache_path.exists():
+        try:
+            with pa.memory_map(str(cache_path)) as source:
+                table = pa.ipc.open_file(source).read_all()
+            os.utime(cache_path)  # mark as recently used for eviction
+        except (pa.ArrowInvalid, OSError):
+            table = None  # unreadable snapshot: recompute and overwrite it below
+    if table is None:
+        table = get_con().cursor().execute(sql, params).to_arrow_table()
+        CACHE_DIR.mkdir(exist_ok=True)
+        # Write to a temp file and rename, so readers never see a partial snapshot
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        os.close(fd)
+        try:
+            with pa.ipc.new_file(tmp_path, table.schema) as writer:
+                writer.write_table(table)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            Path(tmp_path).unlink(missing_ok=True)
+        evict_cache(version)
+    # Arrow-backed columns: no conversion to NumPy/object dtypes on the way out
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
 @st.cache_data(show_spinner=False)
-def load_df(path: str) -> pd.DataFrame:
-    return pd.read_parquet(path)
+def date_bounds(version: tuple):
+    # Answered from parquet column statistics; NULL dates are ignored by min/max
+    return get_con().cursor().execute(
+        "SELECT min(date)::DATE, max(date)::DATE FROM daily"
+    ).fetchone()
 
-def apply_plotly_dark(fig, *, height=560, margin=None):
+def window(start, end) -> list:
+    # Half-open [start, end + 1 day) on the raw timestamp column, no per-row cast
+    return [pd.Timestamp(start), pd.Timestamp(end) + pd.Timedelta(days=1)]
+
+@st.cache_data(show_spinner=False)
+def intro_metrics(start, end, version: tuple) -> tuple:
+    # Three scalars for the Intro page, no row-level frame
+    return get_con().cursor().execute("""
+        SELECT
+            (SELECT COALESCE(SUM(rows), 0)::BIGINT FROM daily WHERE date >= $1 AND date < $2),
+            (SELECT SUM(trips)::BIGINT FROM daily WHERE date >= $1 AND date < $2),
+            (SELECT COUNT(DISTINCT start_station_id) FROM station_daily WHERE date >= $1 AND date < $2)
+    """, window(start, end)).fetchone()
+
+@st.cache_data(show_spinner=False)
+def daily_trips(start, end, version: tuple) -> pd.DataFrame:
+    return query("""
+        SELECT date::DATE AS day, trips, avgTemp
+        FROM daily
+        WHERE date >= ? AND date < ?
+        ORDER BY 1
+    """, window(start, end))
+
+@st.cache_data(show_spinner=False)
+def top_stations(start, end, top_n: int, version: tuple) -> pd.DataFrame:
+    return query("""
+        SELECT start_station_id, start_station_name, SUM(trips)::BIGINT AS trips
+        FROM station_daily
+        WHERE date >= ? AND date < ?
+        GROUP BY start_station_id, start_station_name
+        ORDER BY trips DESC
+        LIMIT ?
+    """, window(start, end) + [top_n])
+
+@st.cache_data(show_spinner=False)
+def seasonal_trips(start, end, version: tuple) -> pd.DataFrame:
+    return query("""
+        -- avgTemp weighted by rows per day, matching a mean over the trip rows
+        SELECT season, SUM(trips)::BIGINT AS trips, SUM(avgTemp * rows) / SUM(rows) AS avgTemp
+        FROM daily
+        WHERE date >= ? AND date < ?
+        GROUP BY 1
+        ORDER BY list_position(['winter', 'spring', 'summer', 'fall'], season)
+    """, window(start, end))
+
+# Largest-Triangle-Three-Buckets: row positions that keep the shape of an evenly spaced series
+def lttb(y, n_out: int = MAX_POINTS) -> np.ndarray:
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= n_out:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    keep = np.empty(n_out, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            nxt_x = (edges[i + 1] + edges[i + 2] - 1) / 2
+            nxt_y = y[edges[i + 1]:edges[i + 2]].mean()
+        else:
+            nxt_x, nxt_y = n - 1, y[-1]
+        xs = np.arange(lo, hi)
+        area = np.abs((a - nxt_x) * (y[lo:hi] - y[a]) - (a - xs) * (nxt_y - y[a]))
+        a = lo + int(area.argmax())
+        keep[i + 1] = a
+    return keep
+
+def dark_layout(*, height=560, margin=None) -> dict:
     if margin is None:
         margin = dict(l=70, r=70, t=95, b=55)
-    fig.update_layout(
+    return dict(
         template="plotly_dark",
         paper_bgcolor=BG,
         plot_bgcolor=BG,
@@ -36,37 +192,135 @@ def apply_plotly_dark(fig, *, height=560, margin=None):
         font=dict(size=12, color=FONT),
         hovermode="x unified",
     )
+
+def apply_plotly_dark(fig, *, height=560, margin=None):
+    fig.update_layout(**dark_layout(height=height, margin=margin))
     fig.update_xaxes(gridcolor=GRID, zeroline=False)
     fig.update_yaxes(gridcolor=GRID, zeroline=False)
     return fig
 
-def embed_html(path: str, height: int = 740):
-    p = Path(path)
-    if not p.exists():
-        st.error(f"Map file not found: {path}")
-        st.info("Put the HTML map in the same folder as this script, or update DEFAULT_MAP_HTML.")
-        return
-    components.html(p.read_text(encoding="utf-8"), height=height, scrolling=True)
+# Figure builders return the serialised dict, so a cache hit reuses the figure instead of rebuilding it
+@st.cache_data(show_spinner=False)
+def daily_fig(start, end, version: tuple) -> dict:
+    daily = daily_trips(start, end, version)
+
+    trips_pts = daily[["day", "trips"]].iloc[lttb(daily["trips"])]
+    temp_pts = daily[["day", "avgTemp"]].iloc[lttb(daily["avgTemp"])]
+
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+
+    fig.add_trace(
+        go.Scattergl(
+            x=trips_pts["day"],
+            y=trips_pts["trips"],
+            name="Daily Bike Trips",
+            mode="lines",
+            line=dict(color="#00E5FF", width=2),
+        ),
+        secondary_y=False,
+    )
+
+    fig.add_trace(
+        go.Scattergl(
+            x=temp_pts["day"],
+            y=temp_pts["avgTemp"],
+            name="Average Temperature (°C)",
+            mode="lines",
+            line=dict(color="#FFA726", width=2, dash="dot"),
+        ),
+        secondary_y=True,
+    )
+
+    fig.update_layout(title="Daily Bike Trips vs. Temperature in NYC")
+    fig.update_yaxes(title_text="Number of Trips", secondary_y=False, tickformat=",")
+    fig.update_yaxes(title_text="Temperature (°C)", secondary_y=True, showgrid=False)
+    fig.update_xaxes(title_text="Date")
+
+    apply_plotly_dark(fig, height=560)
+    return fig.to_dict()
+
+@st.cache_data(show_spinner=False)
+def top_stations_fig(start, end, top_n: int, version: tuple) -> dict:
+    top = top_stations(start, end, top_n, version)
+
+    # Per-bar colours sampled from "Blues" up front: no continuous coloraxis or colorbar
+    trips = top["trips"].to_numpy(dtype=float)
+    colors = []
+    if len(trips):
+        norm = (trips - trips.min()) / max(trips.max() - trips.min(), 1)
+        colors = sample_colorscale("Blues", norm.tolist())
+
+    fig = go.Figure(
+        go.Bar(
+            x=top["trips"],
+            y=top["start_station_name"],
+            orientation="h",
+            marker_color=colors,
+            hovertemplate="Number of Trips=%{x}<br>Start Station=%{y}<extra></extra>",
+        )
+    )
+
+    fig.update_layout(title=f"Top {top_n} Most Popular Start Stations")
+    apply_plotly_dark(fig, height=700, margin=dict(l=260, r=60, t=95, b=55))
+    fig.update_xaxes(title_text="Number of Trips", tickformat=",")
+    fig.update_yaxes(title_text="Start Station")
+    # Rows arrive largest-first from the LIMIT query; let Plotly lay them out ascending
+    fig.update_yaxes(categoryorder="total ascending")
+    return fig.to_dict()
+
+# Plain figure dict: built in one pass instead of make_subplots plus several update_* calls
+@st.cache_data(show_spinner=False)
+def seasonal_fig(start, end, version: tuple) -> dict:
+    seasonal = seasonal_trips(start, end, version)
+    season = seasonal["season"].tolist()
+
+    layout = dark_layout(height=560)
+    layout["title"]["text"] = "Seasonal CitiBike Demand vs Temperature"
+    axis = dict(gridcolor=GRID, zeroline=False)
+    layout.update(
+        xaxis=dict(axis, title=dict(text="Season"), showgrid=False, domain=[0.0, 0.94], anchor="y"),
+        yaxis=dict(axis, title=dict(text="Total Trips"), tickformat=",", anchor="x"),
+        yaxis2=dict(axis, title=dict(text="Average Temperature (°C)"), showgrid=False,
+                    overlaying="y", side="right", anchor="x"),
+    )
 
-def month_to_season(m: int) -> str:
-    if m in (12, 1, 2): return "winter"
-    if m in (3, 4, 5):  return "spring"
-    if m in (6, 7, 8):  return "summer"
-    return "fall"
+    return {
+        "data": [
+            {"type": "bar", "x": season, "y": seasonal["trips"].tolist(), "name": "Total Trips",
+             "marker": {"color": "#00E5FF"}, "opacity": 0.9},
+            {"type": "scattergl", "x": season, "y": seasonal["avgTemp"].tolist(),
+             "name": "Average Temperature (°C)", "yaxis": "y2", "mode": "lines+markers",
+             "line": {"color": "#FFA726", "width": 3}, "marker": {"size": 8}},
+        ],
+        "layout": layout,
+    }
+
+@st.cache_data(ttl=5, show_spinner=False)
+def list_html_files() -> list:
+    return sorted([p.name for p in MAP_DIR.glob("*.html")])
+
+def embed_html(name: str, height: int = 740):
+    # The browser fetches (and caches) the map itself instead of receiving it inline on every rerun
+    if not (MAP_DIR / name).exists():
+        st.error(f"Map file not found: {MAP_DIR / name}")
+        st.info(f"Put the HTML map in the {MAP_DIR}/ folder next to this script, or update DEFAULT_MAP_HTML.")
+        return
+    st.iframe(f"/app/static/{name}", height=height)
 
 
 #---------------- Load Data ----------------
-if not Path(DATA_FILE).exists():
-    st.error(f"Missing data file: {DATA_FILE}")
-    st.stop()
+for f in (DAILY_FILE, STATION_DAILY_FILE):
+    if not Path(f).exists():
+        st.error(f"Missing data file: {f}")
+        st.info(f"Build it from {DATA_FILE} with `python prepare_data.py`.")
+        st.stop()
 
-df = load_df(DATA_FILE).copy()
-df["date"] = pd.to_datetime(df["date"], errors="coerce")
-df = df.dropna(subset=["date"])
+# Passed to every cached function so all cache layers refresh after a rebuild
+version = data_version()
 
 #Sidebar controls
 st.sidebar.header("Controls")
-min_d, max_d = df["date"].min().date(), df["date"].max().date()
+min_d, max_d = date_bounds(version)
 start_date, end_date = st.sidebar.date_input(
     "Date range",
     value=(min_d, max_d),
@@ -74,8 +328,6 @@ start_date, end_date = st.sidebar.date_input(
     max_value=max_d,
 )
 
-df_f = df[(df["date"].dt.date >= start_date) & (df["date"].dt.date <= end_date)].copy()
-
 pages = [
     "Intro",
     "Daily Trips vs Temperature",
@@ -101,10 +353,12 @@ Use the sidebar pages to explore:
 - Final recommendations
 """)
 
+    n_rows, n_trips, n_stations = intro_metrics(start_date, end_date, version)
+
     c1, c2, c3 = st.columns(3)
-    c1.metric("Rows in sample (filtered)", f"{len(df_f):,}")
-    c2.metric("Trips (sum)", f"{int(df_f['trips'].sum()):,}")
-    c3.metric("Unique start stations", f"{df_f['start_station_id'].nunique():,}")
+    c1.metric("Rows in sample (filtered)", f"{n_rows:,}")
+    c2.metric("Trips (sum)", f"{int(n_trips or 0):,}")
+    c3.metric("Unique start stations", f"{n_stations:,}")
 
     st.caption("Data source: reduced sample parquet for fast dashboard performance.")
     st.info("Tip: Adjust the date range in the sidebar to see how patterns shift over time.")
@@ -114,42 +368,7 @@ Use the sidebar pages to explore:
 elif page == "Daily Trips vs Temperature":
     st.title("Daily Bike Trips vs Temperature")
 
-    daily = (
-        df_f.assign(day=df_f["date"].dt.date)
-           .groupby("day", as_index=False)
-           .agg(trips=("trips", "sum"), avgTemp=("avgTemp", "mean"))
-    )
-
-    fig = make_subplots(specs=[[{"secondary_y": True}]])
-
-    fig.add_trace(
-        go.Scatter(
-            x=daily["day"],
-            y=daily["trips"],
-            name="Daily Bike Trips",
-            mode="lines",
-            line=dict(color="#00E5FF", width=2),
-        ),
-        secondary_y=False,
-    )
-
-    fig.add_trace(
-        go.Scatter(
-            x=daily["day"],
-            y=daily["avgTemp"],
-            name="Average Temperature (°C)",
-            mode="lines",
-            line=dict(color="#FFA726", width=2, dash="dot"),
-        ),
-        secondary_y=True,
-    )
-
-    fig.update_layout(title="Daily Bike Trips vs. Temperature in NYC")
-    fig.update_yaxes(title_text="Number of Trips", secondary_y=False, tickformat=",")
-    fig.update_yaxes(title_text="Temperature (°C)", secondary_y=True, showgrid=False)
-    fig.update_xaxes(title_text="Date")
-
-    apply_plotly_dark(fig, height=560)
+    fig = daily_fig(start_date, end_date, version)
     st.plotly_chart(fig, use_container_width=True)
 
     st.markdown("""
@@ -166,27 +385,7 @@ elif page == "Most Popular Stations":
 
     top_n = st.slider("Top N stations", 10, 50, 20, 5)
 
-    top = (
-        df_f.groupby(["start_station_id", "start_station_name"], as_index=False)
-            .agg(trips=("trips", "sum"))
-            .sort_values("trips", ascending=False)
-            .head(top_n)
-            .sort_values("trips")
-    )
-
-    fig = px.bar(
-        top,
-        x="trips",
-        y="start_station_name",
-        orientation="h",
-        title=f"Top {top_n} Most Popular Start Stations",
-        labels={"trips": "Number of Trips", "start_station_name": "Start Station"},
-        color="trips",
-        color_continuous_scale="Blues",
-    )
-
-    apply_plotly_dark(fig, height=700, margin=dict(l=260, r=60, t=95, b=55))
-    fig.update_xaxes(tickformat=",")
+    fig = top_stations_fig(start_date, end_date, top_n, version)
     st.plotly_chart(fig, use_container_width=True)
 
     st.markdown("""
@@ -201,9 +400,9 @@ elif page == "Most Popular Stations":
 elif page == "Interactive Map":
     st.title("Interactive Map")
 
-    html_files = sorted([p.name for p in Path(".").glob("*.html")])
+    html_files = list_html_files()
     if not html_files:
-        st.error("No .html map files found in this folder. Add your exported map HTML here.")
+        st.error(f"No .html map files found in {MAP_DIR}/. Add your exported map HTML there.")
         st.stop()
 
     default_idx = html_files.index(DEFAULT_MAP_HTML) if DEFAULT_MAP_HTML in html_files else 0
@@ -226,37 +425,7 @@ elif page == "Interactive Map":
 elif page == "Extra Insight (Seasonality)":
     st.title("Extra Insight: Seasonal Demand")
 
-    d = df_f.copy()
-    d["season"] = d["date"].dt.month.map(month_to_season)
-
-    season_order = ["winter", "spring", "summer", "fall"]
-    d["season"] = pd.Categorical(d["season"], categories=season_order, ordered=True)
-
-    seasonal = (
-        d.groupby("season", as_index=False)
-         .agg(trips=("trips", "sum"), avgTemp=("avgTemp", "mean"))
-         .sort_values("season")
-    )
-
-    fig = make_subplots(specs=[[{"secondary_y": True}]])
-    fig.add_trace(
-        go.Bar(x=seasonal["season"], y=seasonal["trips"], name="Total Trips",
-               marker=dict(color="#00E5FF"), opacity=0.9),
-        secondary_y=False,
-    )
-    fig.add_trace(
-        go.Scatter(x=seasonal["season"], y=seasonal["avgTemp"], name="Average Temperature (°C)",
-                   mode="lines+markers", line=dict(color="#FFA726", width=3),
-                   marker=dict(size=8)),
-        secondary_y=True,
-    )
-
-    fig.update_layout(title="Seasonal CitiBike Demand vs Temperature")
-    fig.update_yaxes(title_text="Total Trips", secondary_y=False, tickformat=",")
-    fig.update_yaxes(title_text="Average Temperature (°C)", secondary_y=True, showgrid=False)
-    fig.update_xaxes(title_text="Season", showgrid=False)
-
-    apply_plotly_dark(fig, height=560)
+    fig = seasonal_fig(start_date, end_date, version)
     st.plotly_chart(fig, use_container_width=True)
 
     st.markdown("""